@@ -1,19 +1,38 @@
 import os
+import argparse
 import sys
 import subprocess
 import platform
+import hashlib
+import functools
+import glob
+import shutil
+import tarfile
 import tempfile
+import time
 import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
 from urllib.parse import urljoin
 
+_VER_RE = re.compile(r'^v?(\d+\.\d+(?:\.\d+)?)$')
 
-def run_command(command, description=""):
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[502, 503, 504])))
+
+
+def run_command(argv, description="", cwd=None):
     print(f"\n[INFO] {description}...")
     try:
-        subprocess.run(command, shell=True, check=True)
+        subprocess.run(argv, cwd=cwd, check=True)
         print(f"[SUCCESS] {description} completed!\n")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, OSError) as e:
         print(f"[ERROR] {description} failed: {e}\n")
         sys.exit(1)
 
@@ -22,10 +41,42 @@ def get_script_directory():
     return os.path.dirname(os.path.abspath(__file__))
 
 
+def get_cache_directory():
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    cache_dir = os.path.join(cache_home, "geant4")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_cached_tarball_valid(cache_path):
+    checksum_path = f"{cache_path}.sha256"
+    if not os.path.exists(cache_path) or not os.path.exists(checksum_path):
+        return False
+    with open(checksum_path) as f:
+        fields = f.read().split()
+    return bool(fields) and file_sha256(cache_path) == fields[0]
+
+
 def get_cpu_cores():
+    if hasattr(os, "sched_getaffinity"):
+        default = len(os.sched_getaffinity(0))
+    else:
+        default = os.cpu_count() or 1
+
     while True:
+        answer = input(f"CPU cores for compilation [{default}]: ").strip()
+        if not answer:
+            return default
         try:
-            cores = int(input("Enter the number of CPU cores for compilation: ").strip())
+            cores = int(answer)
             if cores > 0:
                 return cores
         except ValueError:
@@ -33,18 +84,14 @@ def get_cpu_cores():
         print("Invalid input. Try again.")
 
 
+@functools.lru_cache(maxsize=1)
 def get_linux_distro():
     try:
-        result = subprocess.run(["lsb_release", "-ds"], capture_output=True, text=True, check=True)
-        return result.stdout.strip().strip('"')
-    except:
-        try:
-            with open("/etc/os-release") as f:
-                for line in f:
-                    if line.startswith("PRETTY_NAME"):
-                        return line.strip().split("=")[1].strip('"')
-        except:
-            return "Unknown"
+        with open("/etc/os-release") as f:
+            kv = dict(line.strip().split("=", 1) for line in f if "=" in line)
+    except OSError:
+        return "Unknown"
+    return kv.get("PRETTY_NAME", "Unknown").strip('"')
 
 
 def detect_os():
@@ -68,10 +115,21 @@ def detect_os():
 
 
 def get_latest_geant4_version():
-    base_url = "https://gitlab.cern.ch/geant4/geant4/-/archive/"
-    response = requests.get("https://gitlab.cern.ch/geant4/geant4/-/tags")
-    matches = re.findall(r'v(\d+\.\d+(?:\.\d+)?)', response.text)
-    versions = sorted(set(matches), key=lambda x: list(map(int, x.split("."))), reverse=True)
+    try:
+        response = _SESSION.get(
+            "https://gitlab.cern.ch/api/v4/projects/geant4%2Fgeant4/repository/tags?per_page=20&order_by=version",
+            headers={"Accept": "application/json"},
+            timeout=30,
+        )
+        response.raise_for_status()
+        tags = response.json()
+        if not isinstance(tags, list):
+            raise ValueError(f"unexpected response: {tags}")
+        matches = (_VER_RE.match(tag.get("name", "")) for tag in tags)
+        versions = [m.group(1) for m in matches if m]
+    except (requests.RequestException, ValueError, AttributeError):
+        versions = []
+    versions.sort(key=lambda v: tuple(map(int, v.split("."))), reverse=True)
     if not versions:
         print("[ERROR] Could not detect Geant4 versions.")
         sys.exit(1)
@@ -90,28 +148,125 @@ def get_latest_geant4_version():
         print("Invalid input. Try again.")
 
 
-def install_packages(distro):
+def stream_download(url, path):
+    h = hashlib.sha256()
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    print("\n[INFO] Downloading Geant4 Source...")
+    try:
+        r = _SESSION.get(url, stream=True, timeout=60, headers=headers)
+        if r.status_code == 416 and offset:
+            # The partial file is already complete (or larger than the remote); start over.
+            r.close()
+            os.remove(path)
+            offset = 0
+            r = _SESSION.get(url, stream=True, timeout=60)
+        with r:
+            r.raise_for_status()
+            if r.status_code == 206:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        h.update(chunk)
+                mode = "ab"
+            else:
+                offset = 0
+                mode = "wb"
+
+            chunks = r.iter_content(chunk_size=1 << 20)
+            if tqdm is not None:
+                total = int(r.headers.get("Content-Length", 0)) + offset or None
+                progress = tqdm(total=total, initial=offset, unit="B", unit_scale=True)
+            else:
+                progress = None
+
+            with open(path, mode) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    h.update(chunk)
+                    if progress is not None:
+                        progress.update(len(chunk))
+            if progress is not None:
+                progress.close()
+    except requests.RequestException as e:
+        print(f"[ERROR] Downloading Geant4 Source failed: {e}\n")
+        sys.exit(1)
+
+    print("[SUCCESS] Downloading Geant4 Source completed!\n")
+    return h.hexdigest()
+
+
+def download_tarball(url, path):
+    if shutil.which("aria2c"):
+        cmd = [
+            "aria2c", "-x", "16", "-s", "16", "-k", "1M", "-c", "--file-allocation=none",
+            "-d", os.path.dirname(path), "-o", os.path.basename(path), url,
+        ]
+        run_command(cmd, "Downloading Geant4 Source")
+        digest = file_sha256(path)
+    else:
+        digest = stream_download(url, path)
+
+    with open(f"{path}.sha256", "w") as f:
+        f.write(f"{digest}  {os.path.basename(path)}\n")
+
+
+def extract_tarball(tarball, dest):
+    print("\n[INFO] Extracting Source Code...")
+    extract_kwargs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    try:
+        if shutil.which("pigz"):
+            proc = subprocess.Popen(["pigz", "-dc", tarball], stdout=subprocess.PIPE)
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as t:
+                t.extractall(path=dest, **extract_kwargs)
+            proc.stdout.close()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        else:
+            with tarfile.open(tarball, mode="r|gz") as t:
+                t.extractall(path=dest, **extract_kwargs)
+    except (tarfile.TarError, subprocess.CalledProcessError, OSError) as e:
+        print(f"[ERROR] Extracting Source Code failed: {e}\n")
+        sys.exit(1)
+    print("[SUCCESS] Extracting Source Code completed!\n")
+
+
+def get_package_command(distro):
     if "arch" in distro.lower():
-        pkg_cmd = "sudo pacman -Sy --noconfirm cmake gcc binutils glew libjpeg-turbo libpng libtiff giflib libxml2 openssl fftw qt5-base qt5-tools mesa glu libxmu"
+        pkg_cmd = "sudo pacman -Sy --noconfirm --needed cmake ninja gcc binutils glew libjpeg-turbo libpng libtiff giflib libxml2 openssl fftw qt5-base qt5-tools mesa glu libxmu".split()
     elif any(name in distro.lower() for name in ["ubuntu", "debian", "mint"]):
-        pkg_cmd = "sudo apt update && sudo apt install -y cmake cmake-curses-gui g++ gcc binutils libx11-dev libxpm-dev libxft-dev libxext-dev libglew-dev libjpeg-dev libpng-dev libtiff-dev libgif-dev libxml2-dev libssl-dev libfftw3-dev qtbase5-dev qtchooser qttools5-dev-tools libgl1-mesa-dev libglu1-mesa-dev libxmu-dev"
+        pkg_cmd = "sudo env DEBIAN_FRONTEND=noninteractive apt install -y --no-install-recommends cmake cmake-curses-gui ninja-build g++ gcc binutils libx11-dev libxpm-dev libxft-dev libxext-dev libglew-dev libjpeg-dev libpng-dev libtiff-dev libgif-dev libxml2-dev libssl-dev libfftw3-dev qtbase5-dev qtchooser qttools5-dev-tools libgl1-mesa-dev libglu1-mesa-dev libxmu-dev".split()
     elif "opensuse" in distro.lower():
-        pkg_cmd = "sudo zypper install -y cmake gcc gcc-c++ libX11-devel libXpm-devel libXft-devel libXext-devel glew-devel libjpeg-devel libpng-devel libtiff-devel giflib-devel libxml2-devel libopenssl-devel fftw3-devel libqt5-qtbase-devel Mesa-libGL-devel Mesa-libGLU-devel libXmu-devel"
+        pkg_cmd = "sudo zypper install -y --no-recommends cmake ninja gcc gcc-c++ libX11-devel libXpm-devel libXft-devel libXext-devel glew-devel libjpeg-devel libpng-devel libtiff-devel giflib-devel libxml2-devel libopenssl-devel fftw3-devel libqt5-qtbase-devel Mesa-libGL-devel Mesa-libGLU-devel libXmu-devel".split()
     elif "rocky" in distro.lower() or "rhel" in distro.lower():
-        pkg_cmd = "sudo dnf install -y cmake gcc gcc-c++ binutils libX11-devel libXpm-devel libXft-devel libXext-devel glew-devel libjpeg-turbo-devel libpng-devel libtiff-devel giflib-devel libxml2-devel openssl-devel fftw-devel qt5-qtbase-devel qt5-qttools-devel mesa-libGL-devel mesa-libGLU-devel libXmu-devel"
+        pkg_cmd = "sudo dnf install -y --setopt=install_weak_deps=False cmake ninja-build gcc gcc-c++ binutils libX11-devel libXpm-devel libXft-devel libXext-devel glew-devel libjpeg-turbo-devel libpng-devel libtiff-devel giflib-devel libxml2-devel openssl-devel fftw-devel qt5-qtbase-devel qt5-qttools-devel mesa-libGL-devel mesa-libGLU-devel libXmu-devel".split()
     elif "fedora" in distro.lower():
         if platform.release().startswith("41"):
-            pkg_cmd = "sudo dnf5 install -y cmake gcc gcc-c++ binutils qt5-qtbase-devel qt5-qttools-devel mesa-libGL-devel mesa-libGLU-devel libXmu-devel"
+            pkg_cmd = "sudo dnf5 install -y --setopt=install_weak_deps=False cmake ninja-build gcc gcc-c++ binutils qt5-qtbase-devel qt5-qttools-devel mesa-libGL-devel mesa-libGLU-devel libXmu-devel".split()
         else:
-            pkg_cmd = "sudo dnf install -y cmake gcc gcc-c++ binutils qt5-qtbase-devel qt5-qttools-devel mesa-libGL-devel mesa-libGLU-devel libXmu-devel"
+            pkg_cmd = "sudo dnf install -y --setopt=install_weak_deps=False cmake ninja-build gcc gcc-c++ binutils qt5-qtbase-devel qt5-qttools-devel mesa-libGL-devel mesa-libGLU-devel libXmu-devel".split()
     else:
+        return None
+
+    return pkg_cmd
+
+
+def install_packages(distro):
+    pkg_cmd = get_package_command(distro)
+    if pkg_cmd is None:
         print("[WARNING] Distro not recognized. Please install dependencies manually.")
         return
 
+    if "apt" in pkg_cmd:
+        lists_dir = "/var/lib/apt/lists"
+        has_lists = bool(glob.glob(os.path.join(lists_dir, "*_Packages")))
+        if not has_lists or time.time() - os.path.getmtime(lists_dir) > 3600:
+            run_command(["sudo", "apt", "update"], "Updating package lists")
+
     run_command(pkg_cmd, "Installing dependencies")
 
 
-def install_geant4():
+def install_geant4(interactive=False):
     os_type, distro = detect_os()
     if os_type == "Windows":
         print("\n[WARNING] Script only supports Linux or WSL. Windows script is under development.\n")
@@ -120,53 +275,99 @@ def install_geant4():
     script_dir = get_script_directory()
     geant4_dir = os.path.join(script_dir, "Geant4")
     os.makedirs(geant4_dir, exist_ok=True)
-    os.chdir(geant4_dir)
 
     version = get_latest_geant4_version()
     tarball = f"geant4-v{version}.tar.gz"
     tar_url = f"https://gitlab.cern.ch/geant4/geant4/-/archive/v{version}/{tarball}"
     src_dir = f"geant4-v{version}"
     build_dir = f"geant4-v{version}-build"
-
-    if os.path.exists(tarball):
-        print(f"[WARNING] {tarball} already exists.")
+    tarball_path = os.path.join(geant4_dir, tarball)
+    src_path = os.path.join(geant4_dir, src_dir)
+    build_path = os.path.join(geant4_dir, build_dir)
+
+    unpacked_marker = os.path.join(src_path, ".unpacked")
+    cache_path = os.path.join(get_cache_directory(), tarball)
+    unpacked = os.path.exists(unpacked_marker) and os.path.exists(os.path.join(src_path, "CMakeLists.txt"))
+    need_download = False
+
+    if unpacked:
+        print(f"[INFO] Source tree '{src_dir}' already unpacked, skipping download and extraction.")
+    elif is_cached_tarball_valid(cache_path):
+        print(f"[WARNING] {tarball} already cached in {os.path.dirname(cache_path)}.")
         choice = input("Do you want to [R]edownload, [S]kip, or [A]bort? (R/S/A): ").strip().lower()
         if choice == 'r':
-            run_command(f"rm -f {tarball}", "Removing existing tarball")
-            run_command(f"wget {tar_url}", "Downloading Geant4 Source")
+            run_command(["rm", "-f", cache_path, f"{cache_path}.sha256"], "Removing cached tarball")
+            need_download = True
         elif choice == 's':
-            print("[INFO] Using existing tarball.")
+            print("[INFO] Using cached tarball.")
         else:
             print("[INFO] Aborting.")
             sys.exit(0)
     else:
-        run_command(f"wget {tar_url}", "Downloading Geant4 Source")
+        if os.path.exists(f"{cache_path}.sha256"):
+            print(f"[WARNING] Cached {tarball} failed checksum verification, downloading again.")
+            run_command(["rm", "-f", cache_path, f"{cache_path}.sha256"], "Removing corrupt tarball")
+        need_download = True
+
+    if need_download:
+        # Ask for the sudo password now so it isn't buried under download progress.
+        if get_package_command(distro) is not None:
+            run_command(["sudo", "-v"], "Refreshing sudo credentials")
+        # Download in the main thread so Ctrl-C still interrupts it; the package
+        # manager child process receives the same SIGINT.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            packages = executor.submit(install_packages, distro)
+            download_tarball(tar_url, cache_path)
+            packages.result()
+    else:
+        install_packages(distro)
 
-    run_command(f"tar xzfv {tarball}", "Extracting Source Code")
+    if not unpacked:
+        if os.path.lexists(tarball_path):
+            os.remove(tarball_path)
+        os.symlink(cache_path, tarball_path)
 
-    if os.path.exists(build_dir):
-        if os.listdir(build_dir):
+        extract_tarball(tarball_path, geant4_dir)
+        open(unpacked_marker, "w").close()
+
+    if os.path.exists(build_path):
+        if os.listdir(build_path):
             print(f"[WARNING] Build dir '{build_dir}' not empty.")
             choice = input("[C]lear, [S]kip, or [A]bort? (C/S/A): ").strip().lower()
             if choice == 'c':
-                run_command(f"rm -rf {build_dir}", "Clearing build directory")
-                os.makedirs(build_dir)
+                run_command(["rm", "-rf", build_path], "Clearing build directory")
+                os.makedirs(build_path)
             elif choice == 's':
                 print("[INFO] Continuing with existing build dir.")
             else:
                 print("[INFO] Aborting.")
                 sys.exit(0)
     else:
-        os.makedirs(build_dir)
-
-    os.chdir(build_dir)
-
-    install_packages(distro)
+        os.makedirs(build_path)
 
-    install_path = os.path.join(script_dir, "Geant4", f"geant4-v{version}-install")
+    install_path = os.path.join(geant4_dir, f"geant4-v{version}-install")
     print(f"[INFO] Install path: {install_path}\n")
 
-    instructions = f"""
+    cores = get_cpu_cores()
+    os.environ["CMAKE_BUILD_PARALLEL_LEVEL"] = str(cores)
+
+    if shutil.which("ninja") and not os.path.exists(os.path.join(build_path, "CMakeCache.txt")):
+        os.environ.setdefault("CMAKE_GENERATOR", "Ninja")
+        print(f"[INFO] Using the {os.environ['CMAKE_GENERATOR']} generator.")
+
+    use_ccache = shutil.which("ccache") is not None
+    if use_ccache:
+        cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        os.environ.setdefault("CMAKE_C_COMPILER_LAUNCHER", "ccache")
+        os.environ.setdefault("CMAKE_CXX_COMPILER_LAUNCHER", "ccache")
+        os.environ.setdefault("CCACHE_DIR", os.path.join(cache_home, "ccache-geant4"))
+        os.environ.setdefault("CCACHE_MAXSIZE", "20G")
+        print(f"[INFO] Using ccache (cache dir: {os.environ['CCACHE_DIR']}).")
+        if interactive and os.path.exists(os.path.join(build_path, "CMakeCache.txt")):
+            print("[WARNING] Existing CMake cache found; set CMAKE_<LANG>_COMPILER_LAUNCHER=ccache in ccmake to use it.")
+
+    if interactive:
+        instructions = f"""
 [INSTRUCTIONS]
 1. After CMake opens, you'll see: EMPTY CACHE
    - Press 'c' to configure
@@ -186,31 +387,70 @@ Turn ON (ideal settings):
    (You can enable more features if desired.)
 
 4. Press 'c' again to configure. Repeat until 'g' is available.
-5. Press 'g' to generate the Makefile.
+5. Press 'g' to generate the build files.
 6. After closing CMake, return to the terminal.
 """
-    with tempfile.NamedTemporaryFile("w", delete=False, suffix=".txt") as f:
-        f.write(instructions)
-        temp_path = f.name
-
-    run_command(f"xdg-open {temp_path}", "Opening CMake Instructions")
-    input("Press Enter to open the CMake configuration...")
-    run_command(f"ccmake ../{src_dir}", "Running CMake")
-
-    input("Press Enter after completing configuration in CMake...")
+        print("\033[1;36m" + instructions + "\033[0m")
+        input("Press Enter to open the CMake configuration...")
+        run_command(["ccmake", src_path], "Running CMake", cwd=build_path)
 
-    cores = get_cpu_cores()
-    run_command(f"make -j{cores}", "Compiling Geant4")
-    run_command("make install", "Installing Geant4")
+        input("Press Enter after completing configuration in CMake...")
+    else:
+        choice = input("Optimize for this CPU only (-march=native, not portable to other machines)? (Y/N): ").strip().lower()
+        cmake_args = [
+            "cmake", f"-S{src_path}", f"-B{build_path}",
+            f"-DCMAKE_INSTALL_PREFIX={install_path}",
+            "-DCMAKE_BUILD_TYPE=Release",
+            "-DCMAKE_INTERPROCEDURAL_OPTIMIZATION=ON",
+            "-DGEANT4_INSTALL_DATA=ON",
+            "-DGEANT4_USE_OPENGL_X11=ON",
+            "-DGEANT4_USE_QT=ON",
+            "-DGEANT4_USE_RAYTRACER_X11=ON",
+        ]
+        if choice == 'y':
+            cmake_args.append("-DCMAKE_CXX_FLAGS=-march=native")
+        if use_ccache:
+            cmake_args += [
+                f"-DCMAKE_C_COMPILER_LAUNCHER={os.environ['CMAKE_C_COMPILER_LAUNCHER']}",
+                f"-DCMAKE_CXX_COMPILER_LAUNCHER={os.environ['CMAKE_CXX_COMPILER_LAUNCHER']}",
+            ]
+        run_command(cmake_args, "Configuring Geant4")
+
+    run_command(["cmake", "--build", build_path, "--parallel", str(cores), "--target", "install"], "Compiling and installing Geant4")
+    if use_ccache:
+        print("\n[INFO] ccache statistics:")
+        try:
+            subprocess.run(["ccache", "-s"])
+        except OSError as e:
+            print(f"[WARNING] Could not report ccache statistics: {e}")
 
     alias_cmd = f'alias geant4make="source {install_path}/share/Geant4/geant4make/geant4make.sh"'
-    bashrc = os.path.join(os.path.expanduser("~"), ".bashrc")
-    with open(bashrc, "a") as f:
-        f.write(f"\n{alias_cmd}\n")
+    bashrc = os.path.realpath(os.path.join(os.path.expanduser("~"), ".bashrc"))
+    try:
+        with open(bashrc) as f:
+            existing = f.read()
+    except FileNotFoundError:
+        existing = ""
 
-    print("\n[INFO] Added alias to .bashrc. Run 'source ~/.bashrc' to activate it.")
+    if alias_cmd in existing:
+        print("\n[INFO] Alias already present in .bashrc.")
+    else:
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(bashrc), delete=False) as f:
+            f.write(f"{existing}\n{alias_cmd}\n")
+            temp_path = f.name
+        if os.path.exists(bashrc):
+            shutil.copymode(bashrc, temp_path)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, bashrc)
+        print("\n[INFO] Added alias to .bashrc. Run 'source ~/.bashrc' to activate it.")
     print("[SUCCESS] Geant4 v{version} installed successfully!")
 
 
 if __name__ == "__main__":
-    install_geant4()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download, build and install Geant4.")
+    parser.add_argument("--interactive", action="store_true", help="configure Geant4 by hand in ccmake")
+    args = parser.parse_args()
+    install_geant4(interactive=args.interactive)
\ No newline at end of file